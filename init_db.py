@@ -1,11 +1,71 @@
 
 import aiosqlite
 import asyncio
+from itertools import islice
+from typing import Iterable
 
 DB_NAME = "trade_bot.db"
 
+# Размер пачки для executemany: входные строки читаются порциями,
+# поэтому генератор на миллионы позиций не материализуется в памяти целиком
+INSERT_BATCH_SIZE = 500
+
+# Настройки SQLite под журнал бота с частыми вставками
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Схема истории позиций (используется и при миграции старой таблицы)
+POSITIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS positions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        symbol TEXT,
+        side TEXT,
+        entry_price REAL,
+        size_usd REAL,
+        pnl REAL,
+        status TEXT, -- OPEN, CLOSED, CANCELLED
+        timestamp INTEGER DEFAULT (unixepoch()) -- unix seconds
+    )
+"""
+
+async def apply_pragmas(db: aiosqlite.Connection):
+    """Применяет PRAGMA-настройки к соединению."""
+    for pragma in PRAGMAS:
+        await db.execute(pragma)
+
+async def migrate_positions(db: aiosqlite.Connection):
+    """
+    Переводит positions из старой схемы (timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+    текст 'YYYY-MM-DD HH:MM:SS') в INTEGER unix-секунды. Вызывается внутри транзакции init_db.
+    """
+    async with db.execute("PRAGMA table_info(positions)") as cursor:
+        columns = {row[1]: row[2] for row in await cursor.fetchall()}
+    if columns.get("timestamp", "").upper() == "INTEGER":
+        return
+
+    print("🔧 Миграция positions: timestamp -> INTEGER (unix seconds)")
+    # Старые индексы уйдут вместе со старой таблицей, новый создается в init_db
+    await db.execute("ALTER TABLE positions RENAME TO positions_old")
+    await db.execute(POSITIONS_DDL)
+    await db.execute("""
+        INSERT INTO positions (id, symbol, side, entry_price, size_usd, pnl, status, timestamp)
+        SELECT id, symbol, side, entry_price, size_usd, pnl, status,
+               CASE WHEN typeof(timestamp) = 'text' THEN unixepoch(timestamp) ELSE timestamp END
+        FROM positions_old
+    """)
+    await db.execute("DROP TABLE positions_old")
+
 async def init_db():
     async with aiosqlite.connect(DB_NAME) as db:
+        await apply_pragmas(db)
+
+        # Вся схема создается в одной транзакции (один fsync вместо одного на запрос)
+        await db.execute("BEGIN IMMEDIATE")
+
         # Users whitelist
         await db.execute("""
             CREATE TABLE IF NOT EXISTS allowed_users (
@@ -13,23 +73,46 @@ async def init_db():
                 username TEXT
             )
         """)
-        
+
         # Positions history
+        await db.execute(POSITIONS_DDL)
+        await migrate_positions(db)
+
+        # Индекс под выборки по тикеру/статусу за период
         await db.execute("""
-            CREATE TABLE IF NOT EXISTS positions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                symbol TEXT,
-                side TEXT,
-                entry_price REAL,
-                size_usd REAL,
-                pnl REAL,
-                status TEXT, -- OPEN, CLOSED, CANCELLED
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
+            CREATE INDEX IF NOT EXISTS idx_pos_sym_status_ts
+            ON positions (symbol, status, timestamp DESC)
         """)
-        
+
         await db.commit()
     print(f"Database {DB_NAME} initialized.")
 
+async def insert_positions(rows: Iterable[tuple]):
+    """
+    Пакетная запись позиций одной транзакцией (пачками по INSERT_BATCH_SIZE строк).
+    При ошибке транзакция откатывается целиком.
+
+    :param rows: Кортежи (symbol, side, entry_price, size_usd, pnl, status, timestamp),
+                 timestamp — unix-секунды (int(time.time()))
+    """
+    rows = iter(rows)
+    batch = list(islice(rows, INSERT_BATCH_SIZE))
+    if not batch:
+        return
+    async with aiosqlite.connect(DB_NAME) as db:
+        await apply_pragmas(db)
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            while batch:
+                await db.executemany(
+                    "INSERT INTO positions (symbol, side, entry_price, size_usd, pnl, status, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    batch
+                )
+                batch = list(islice(rows, INSERT_BATCH_SIZE))
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
 if __name__ == "__main__":
     asyncio.run(init_db())
@@ -3,6 +3,8 @@ import asyncio
 import logging
 import os
 import html
+from string import Template
+from concurrent.futures import ThreadPoolExecutor
 
 from aiogram import Bot, Dispatcher, types, F
 from aiogram.filters import Command
@@ -33,8 +35,34 @@ dp = Dispatcher()
 
 market_data = MarketDataService()
 ai_service = AIService()
+chart_generator = ChartGenerator()
 # trading_service = TradingService() # Раскомментируем когда настроим ключи
 
+# Перевод сигнала на русский
+SIGNAL_MAP = {
+    "LONG": "LONG (Покупка) 🟢📈🟢  ",
+    "SHORT": "SHORT (Продажа) 🔴📉🔴  ",
+    "NEUTRAL": "NEUTRAL (Ждем) 😐  ",
+}
+
+# Шаблоны ответа компилируются один раз при импорте
+# Краткая подпись для графика (чтобы не превысить лимит 1024 символа)
+SHORT_CAPTION_TMPL = Template(
+    "📊 <b>Анализ $symbol (1H)</b>\n"
+    "Сигнал: <b>$signal</b>\n"
+    "Сетап: $setup\n"
+    "Уверенность: $confidence/10 $confidence_emoji\n\n"
+    "🎯 Вход: $entry_range\n"
+    "🛑 Стоп: $stop_loss\n"
+    "✅ Тейк: $take_profit_1 / $take_profit_2\n\n"
+    "👇 <i>Подробное обоснование ниже</i>"
+)
+# Полный текст обоснования отдельным сообщением
+FULL_TEXT_TMPL = Template(
+    "📝 <b>Подробный анализ $symbol:</b>\n\n"
+    "$reasoning"
+)
+
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message):
     """Обработчик команды /start"""
@@ -54,23 +82,22 @@ async def analyze_ticker(message: types.Message):
     
     try:
         # 1. Получаем данные (1 час)
-        df = market_data.get_candles(symbol, interval="1h", limit=200)
+        df = await market_data.get_candles(symbol, interval="1h", limit=200)
         
         if df.empty:
             await status_msg.edit_text(f"❌ Не удалось найти данные по тикеру {symbol}.")
             return
 
-        # 2. Считаем индикаторы
-        df, pivots = IndicatorEngine.add_all_indicators(df)
+        # 2. Считаем индикаторы (pandas в потоке, чтобы не блокировать event loop)
+        df, pivots = await asyncio.to_thread(IndicatorEngine.add_all_indicators, df)
 
         await bot.edit_message_text(f"🧠 {AI} анализирует структуру рынка для {symbol}...", chat_id=message.chat.id, message_id=status_msg.message_id)
 
-        # 3. Спрашиваем ИИ
-        # Передаем копию, чтобы не сломать логику если меняется df
-        ai_result = await ai_service.analyze_market(symbol, df, pivots)
-        
-        # 4. Генерируем график
-        chart_buffer = ChartGenerator.generate_chart(df, symbol, "5m", pivots)
+        # 3-4. Спрашиваем ИИ и параллельно рисуем график (задачи независимы)
+        ai_result, chart_bytes = await asyncio.gather(
+            ai_service.analyze_market(symbol, df, pivots),
+            chart_generator.generate_chart(df, symbol, "5m", pivots)
+        )
         
         # 5. Формируем ответ
         confidence = ai_result.get('confidence', 0)
@@ -81,41 +108,27 @@ async def analyze_ticker(message: types.Message):
         reasoning_safe = html.escape(str(ai_result.get('reasoning', '')))
         setup_safe = html.escape(str(ai_result.get('setup_name', '')))
         
-        # Перевод сигнала на русский
-        raw_signal = str(ai_result.get('signal', '')).upper()
-        signal_ru = raw_signal
-        if "LONG" in raw_signal:
-            signal_ru = "LONG (Покупка) 🟢📈🟢  "
-        elif "SHORT" in raw_signal:
-            signal_ru = "SHORT (Продажа) 🔴📉🔴  "
-        elif "NEUTRAL" in raw_signal:
-            signal_ru = "NEUTRAL (Ждем) 😐  "
-            
-        signal_safe = html.escape(signal_ru)
+        raw_signal = str(ai_result.get('signal', '')).upper().strip()
+        signal_safe = html.escape(SIGNAL_MAP.get(raw_signal, raw_signal))
         
-        # Краткая подпись для графика (чтобы не превысить лимит 1024 символа)
-        short_caption = (
-            f"📊 <b>Анализ {symbol} (1H)</b>\n"
-            f"Сигнал: <b>{signal_safe}</b>\n"
-            f"Сетап: {setup_safe}\n"
-            f"Уверенность: {confidence}/10 {confidence_emoji}\n\n"
-            f"🎯 Вход: {ai_result.get('entry_range')}\n"
-            f"🛑 Стоп: {ai_result.get('stop_loss')}\n"
-            f"✅ Тейк: {ai_result.get('take_profit_1')} / {ai_result.get('take_profit_2')}\n\n"
-            f"👇 <i>Подробное обоснование ниже</i>"
-        )
-        
-        # Полный текст обоснования отдельным сообщением
-        full_text = (
-            f"📝 <b>Подробный анализ {symbol}:</b>\n\n"
-            f"{reasoning_safe}"
+        short_caption = SHORT_CAPTION_TMPL.substitute(
+            symbol=symbol,
+            signal=signal_safe,
+            setup=setup_safe,
+            confidence=confidence,
+            confidence_emoji=confidence_emoji,
+            entry_range=ai_result.get('entry_range'),
+            stop_loss=ai_result.get('stop_loss'),
+            take_profit_1=ai_result.get('take_profit_1'),
+            take_profit_2=ai_result.get('take_profit_2'),
         )
+        full_text = FULL_TEXT_TMPL.substitute(symbol=symbol, reasoning=reasoning_safe)
         
         # Удаляем сообщение "думаю" и присылаем результат
         await status_msg.delete()
         
-        if chart_buffer:
-            input_file = BufferedInputFile(chart_buffer.read(), filename=f"{symbol}_chart.png")
+        if chart_bytes:
+            input_file = BufferedInputFile(chart_bytes, filename=f"{symbol}_chart.png")
             # Отправляем фото с краткими данными
             await message.answer_photo(photo=input_file, caption=short_caption, parse_mode="HTML")
             # Отправляем подробности следом
@@ -133,7 +146,12 @@ async def analyze_ticker(message: types.Message):
             logger.error("Failed to send error message to user")
 async def main():
     print("🤖 Бот запущен!")
-    await dp.start_polling(bot)
+    # Ограниченный пул для блокирующих вызовов (HTTP, pandas) из asyncio.to_thread
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=8))
+    try:
+        await dp.start_polling(bot)
+    finally:
+        market_data.close()
 
 if __name__ == "__main__":
     if not TOKEN:
@@ -0,0 +1,18 @@
+
+"""
+Опциональный Numba JIT.
+Если numba не установлена, декоратор njit ничего не делает и функции
+работают как обычный Python (медленнее, но с тем же результатом).
+"""
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+    def njit(*args, **kwargs):
+        # Поддерживаем обе формы: @njit и @njit(cache=True, ...)
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
@@ -1,13 +1,22 @@
 
 import os
-import json
+import orjson
+import asyncio
 import logging
+from hashlib import blake2b
+# Схемы ответа разбирает pydantic (внутри google-generativeai): typing.TypedDict
+# он принимает только на Python 3.12+, поэтому берем TypedDict из typing_extensions
+from typing_extensions import TypedDict
 import pandas as pd
 import numpy as np
+import httpx
 import google.generativeai as genai
 from dotenv import load_dotenv
 from openai import AsyncOpenAI
 
+from services.cache import LRUCache
+from services.indicators import Pivots
+
 # Загружаем переменные окружения
 load_dotenv()
 
@@ -15,6 +24,113 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Статическая инструкция идет первой: одинаковый префикс во всех запросах
+# позволяет провайдеру переиспользовать его (prefix/context caching)
+SYSTEM_PROMPT = """
+Ты эксперт-трейдер, специализирующийся на Волновой теории Эллиота, методе Вайкоффа и Фибоначчи.
+
+Задача: Проанализируй предоставленные OHLCV данные по тикеру из запроса (1H таймфрейм) и определи, есть ли высоковероятный торговый сетап.
+
+Правила анализа:
+1. **Волны Эллиота**: Определи текущую структуру. Импульс (1,3,5) или Коррекция (A,B,C). Мы ищем вход в начале 3-й или 5-й волны.
+2. **Вайкофф**: Ищи фазы накопления/распределения. Есть ли Spring (пружина) или Upthrust (вынос)? Тест уровней.
+3. **Фибоначчи и Уровни**: Используй уровни Фибоначчи для определения целей (TP) зоны входа.
+4. **Индикаторы**: RSI дивергенция как подтверждение.
+
+Требования к ответу:
+Верни СТРОГО валидный JSON следующей структуры (ключи на английском, значения reason на РУССКОМ):
+{
+    "signal": "LONG" | "SHORT" | "NEUTRAL",
+    "confidence": <int 1-10>,
+    "setup_name": "<string, например: Пробой 3-й волны>",
+    "entry_range": [<float min>, <float max>],
+    "stop_loss": <float price>,
+    "take_profit_1": <float price>,
+    "take_profit_2": <float price>,
+    "reasoning": "<ПОДРОБНОЕ объяснение на РУССКОМ языке. Опиши какая сейчас волна Эллиота, что происходит по Вайкоффу (фаза, тесты), есть ли дивергенция RSI. Объясни, почему выбраны именно такие уровни Stop Loss и Take Profit (уровни Фибо, хай/лоу свинга).>"
+}
+
+Важно:
+- Если уверенность < 7, signal = "NEUTRAL".
+- Stop Loss должен быть логичным (за лоу свинга для лонга).
+- Risk:Reward (RR) минимум 1:2.
+- Ответ "reasoning" должен быть детальным, чтобы пользователь понимал логику входа.
+"""
+
+# Переменная часть запроса (заполняется через format_map)
+USER_PROMPT_TMPL = """
+Тикер: {symbol}
+
+Volume 20SMA: {vol_sma:.2f}
+RSI за 40 свечей: {rsi_stats}
+Наклон тренда (линейная регрессия close): {slope_pct:+.3f}% за свечу
+
+Последние свечи (Last 40, по порядку, шаг 1H, формат [open,high,low,close,volume]).
+Последняя свеча открыта в {last_ts} (unix ms):
+{candles_json}
+
+Пивоты ZigZag (Локальные экстремумы):
+{pivots_json}
+"""
+
+# Инструкция для пакетного запроса (несколько тикеров в одном вызове)
+BATCH_PROMPT_TMPL = """
+Ниже данные по {count} тикерам, каждый блок начинается с ===SYMBOL: <тикер>===.
+Проанализируй каждый тикер независимо по правилам выше и верни СТРОГО JSON вида
+{{"results": [<объект ответа для 1-го тикера>, <для 2-го>, ...]}}
+ровно с {count} элементами в том же порядке, что и блоки.
+"""
+
+# Быстрый предварительный запрос: только сигнал и уверенность, без reasoning
+GATE_PROMPT = """
+Сейчас верни ТОЛЬКО оценку, без остальных полей и без объяснений:
+{"signal": "LONG" | "SHORT" | "NEUTRAL", "confidence": <int 1-10>}
+"""
+
+# Порог уверенности, ниже которого полный анализ не запрашивается
+MIN_CONFIDENCE = 7
+
+# Лимит токенов ответа для предварительного запроса (DeepSeek)
+GATE_MAX_TOKENS = 64
+
+# То же для пакетного запроса
+BATCH_GATE_PROMPT = """
+Сейчас для каждого тикера верни ТОЛЬКО оценку, без остальных полей и без объяснений:
+{"results": [{"signal": "LONG" | "SHORT" | "NEUTRAL", "confidence": <int 1-10>}, ...]}
+"""
+
+class GateSignal(TypedDict):
+    """
+    Схема ответа предварительного запроса.
+    """
+    signal: str
+    confidence: int
+
+class GateSignalBatch(TypedDict):
+    """
+    Схема ответа предварительного пакетного запроса.
+    """
+    results: list[GateSignal]
+
+class TradeSignal(TypedDict):
+    """
+    Схема ответа модели. Передается в Gemini как response_schema.
+    """
+    signal: str
+    confidence: int
+    setup_name: str
+    entry_range: list[float]
+    stop_loss: float
+    take_profit_1: float
+    take_profit_2: float
+    reasoning: str
+
+class TradeSignalBatch(TypedDict):
+    """
+    Схема ответа на пакетный запрос.
+    """
+    results: list[TradeSignal]
+
 class AIService:
     """
     Сервис для взаимодействия с AI (Gemini или DeepSeek).
@@ -27,6 +143,12 @@ class AIService:
         Выбор провайдера зависит от IS_GEMINI в .env.
         """
         self.is_gemini = os.getenv("IS_GEMINI", "True").lower() == "true"
+        # Кэш ответов: ключ — тикер + хэш хвоста свечей (одна и та же свеча = тот же ответ)
+        self._cache = LRUCache(maxsize=256)
+        # Запросы к AI, которые выполняются прямо сейчас (key -> Future с результатом)
+        self._inflight = {}
+        # Ограничение числа одновременных запросов к провайдеру
+        self._sem = asyncio.Semaphore(int(os.getenv("AI_CONCURRENCY", "8")))
         
         if self.is_gemini:
             api_key = os.getenv("GEMINI_API_KEY")
@@ -36,12 +158,18 @@ class AIService:
                 
             genai.configure(api_key=api_key)
             # Конфигурация модели Gemini
+            self.gemini_config = {
+                "temperature": 0.2,
+                "response_mime_type": "application/json",
+                # Строгая схема: модель не может вернуть JSON другой формы
+                "response_schema": TradeSignal
+            }
+            # Статическая инструкция передается как system_instruction один раз,
+            # в запросах уходит только переменная часть
             self.gemini_model = genai.GenerativeModel(
                 model_name="gemini-2.5-pro",
-                generation_config={
-                    "temperature": 0.2,
-                    "response_mime_type": "application/json"
-                }
+                system_instruction=SYSTEM_PROMPT,
+                generation_config=self.gemini_config
             )
             logger.info("🤖 Инициализирован Gemini 2.5 Pro")
         else:
@@ -51,110 +179,334 @@ class AIService:
                 raise ValueError("DEEPSEEK_API_KEY is missing")
             
             # DeepSeek совместим с OpenAI API
+            # Один HTTP-клиент с пулом соединений на все запросы
             self.deepseek_client = AsyncOpenAI(
                 api_key=api_key,
-                base_url="https://api.deepseek.com"
+                base_url="https://api.deepseek.com",
+                http_client=httpx.AsyncClient(limits=httpx.Limits(max_connections=64))
             )
             logger.info("🤖 Инициализирован DeepSeek API")
 
-    async def analyze_market(self, symbol: str, df: pd.DataFrame, pivots: list) -> dict:
+    @staticmethod
+    def _cache_key(symbol: str, df: pd.DataFrame) -> tuple:
+        """
+        Ключ кэша: тикер + blake2b от последних 40 свечей OHLCV.
+        """
+        tail = df[["open", "high", "low", "close", "volume"]].tail(40).to_numpy()
+        return symbol, blake2b(tail.tobytes(), digest_size=16).digest()
+
+    async def analyze_market(self, symbol: str, df: pd.DataFrame, pivots: Pivots) -> dict:
         """
         Анализирует рынок на основе DataFrame свечей и пивотов.
+        Повторный запрос по тем же свечам возвращается из кэша без обращения к AI,
+        а одновременные одинаковые запросы ждут один общий вызов.
         """
-        
-        # 1. Подготовка данных в текстовом виде для промпта
-        last_candle = df.iloc[-1]
-        market_summary = f"""
-        Current Price: {last_candle['close']}
-        RSI (14): {last_candle['rsi']:.2f}
-        Volume 20SMA: {last_candle['vol_sma']:.2f}
-        Current Volume: {last_candle['volume']}
+        key = self._cache_key(symbol, df)
+        while True:
+            cached = self._cache.get(key)
+            if cached is not None:
+                logger.info(f"♻️ Ответ AI для {symbol} взят из кэша")
+                return cached
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            logger.info(f"⏳ Запрос AI для {symbol} уже выполняется, ждем его результат")
+            result = await self._await_shared(inflight)
+            if result is not None:
+                return result
+            # Владелец запроса отменен — повторяем (кэш, чужой запрос или свой)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await self._analyze_uncached(key, symbol, df, pivots)
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+            if not fut.done():
+                fut.cancel()
+
+    @staticmethod
+    async def _await_shared(fut: asyncio.Future) -> dict | None:
         """
+        Ждет общий запрос, выполняемый другой задачей.
+        Возвращает None, если отменили задачу-владельца (вызывающий повторяет запрос сам);
+        отмена самой ожидающей задачи пробрасывается как обычно.
+        """
+        try:
+            # shield: отмена одного ожидающего не должна отменять общий запрос
+            return await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            task = asyncio.current_task()
+            cancelling = getattr(task, "cancelling", None)  # Python 3.11+
+            if not fut.cancelled() or (cancelling is not None and cancelling()):
+                raise
+            return None
+
+    async def _analyze_uncached(self, key, symbol: str, df: pd.DataFrame, pivots: Pivots) -> dict:
+        """
+        Запрос к AI мимо кэша; успешный ответ сохраняется в кэш,
+        при ошибке возвращается нейтральный сигнал (в кэш не кладется).
+        """
+        try:
+            result = await self._request_analysis(symbol, df, pivots)
+            self._cache.set(key, result)
+        except Exception as e:
+            logger.error(f"❌ Ошибка при запросе к AI: {e}")
+            # Возвращаем безопасный нейтральный сигнал при ошибке
+            result = {"signal": "NEUTRAL", "confidence": 0, "reasoning": "AI Error: " + str(e)}
+        return result
+
+    async def analyze_market_batch(self, items: list[tuple[str, pd.DataFrame, Pivots]]) -> list[dict]:
+        """
+        Анализирует несколько тикеров одним запросом к AI (общий системный промпт
+        и один сетевой вызов на всех). Как и analyze_market, сначала короткий пакетный
+        запрос оценивает уверенность, полный разбор запрашивается только для прошедших порог.
+        Тикеры из кэша в запрос не попадают, а уже выполняющиеся запросы не дублируются.
+        При ошибке или неверном ответе откатывается на анализ по одному.
+
+        :param items: Список (symbol, df, pivots)
+        :return: Список сигналов в том же порядке
+        """
+        loop = asyncio.get_running_loop()
+        keys = [self._cache_key(symbol, df) for symbol, df, _ in items]
+        results = [self._cache.get(key) for key in keys]
+
+        # Ключи, которые считает этот вызов (key -> индекс), и чужие/повторные запросы
+        owned = {}
+        waiting = {}
+        for i, (key, result) in enumerate(zip(keys, results)):
+            if result is not None:
+                continue
+            if key in owned:
+                continue
+            if key in self._inflight:
+                waiting[i] = self._inflight[key]
+            else:
+                owned[key] = i
+        futures = {key: loop.create_future() for key in owned}
+        self._inflight.update(futures)
+
+        try:
+            todo = list(owned.values())
+            if len(todo) > 1:
+                try:
+                    logger.info(f"🧠 Пакетный запрос к AI для {len(todo)} тикеров...")
+                    batch = await self._request_batch([items[i] for i in todo])
+                    for i, result in zip(todo, batch):
+                        self._cache.set(keys[i], result)
+                        results[i] = result
+                except Exception as e:
+                    logger.error(f"❌ Ошибка пакетного запроса, анализируем по одному: {e}")
+
+            # Оставшиеся (ошибка пакета или один тикер) — по одному
+            rest = [i for i in todo if results[i] is None]
+            singles = await asyncio.gather(*(self._analyze_uncached(keys[i], *items[i]) for i in rest))
+            for i, result in zip(rest, singles):
+                results[i] = result
+            for key, i in owned.items():
+                futures[key].set_result(results[i])
+        finally:
+            for key, fut in futures.items():
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+                if not fut.done():
+                    fut.cancel()
+
+        # Запросы, которые уже выполнялись в других вызовах
+        for i, fut in waiting.items():
+            result = await self._await_shared(fut)
+            # Владелец запроса отменен — анализируем этот тикер сами
+            results[i] = result if result is not None else await self.analyze_market(*items[i])
+        # Повторы одного и того же тикера внутри пакета
+        for i, key in enumerate(keys):
+            if results[i] is None:
+                results[i] = results[owned[key]]
+        return results
+
+    async def _request_batch(self, items: list[tuple[str, pd.DataFrame, Pivots]]) -> list[dict]:
+        """
+        Пакетный анализ в два этапа: короткая оценка всех тикеров, затем полный разбор
+        только тех, что прошли порог. Ошибки пробрасываются наверх.
+        """
+        blocks = [f"===SYMBOL: {symbol}===\n{self._build_user_block(symbol, df, pivots)}" for symbol, df, pivots in items]
+
+        gate_text = await self._complete(
+            BATCH_PROMPT_TMPL.format(count=len(items)) + "\n".join(blocks) + BATCH_GATE_PROMPT,
+            gemini_config={"response_schema": GateSignalBatch},
+            max_tokens=GATE_MAX_TOKENS * len(items)
+        )
+        results = [
+            self._gate_verdict(symbol, gate)
+            for (symbol, _, _), gate in zip(items, self._parse_batch(gate_text, len(items)))
+        ]
+
+        passed = [j for j, result in enumerate(results) if result is None]
+        if passed:
+            full_text = await self._complete(
+                BATCH_PROMPT_TMPL.format(count=len(passed)) + "\n".join(blocks[j] for j in passed),
+                gemini_config={"response_schema": TradeSignalBatch}
+            )
+            for j, result in zip(passed, self._parse_batch(full_text, len(passed))):
+                results[j] = result
+        return results
+
+    @staticmethod
+    def _parse_batch(response_text: str, count: int) -> list[dict]:
+        """
+        Разбирает ответ пакетного запроса и проверяет, что в нем ровно count объектов с полем signal.
+        """
+        batch = orjson.loads(response_text)["results"]
+        if len(batch) != count:
+            raise ValueError(f"ожидалось {count} ответов, получено {len(batch)}")
+        for result in batch:
+            if not isinstance(result, dict) or "signal" not in result:
+                raise ValueError(f"неверный элемент пакетного ответа: {result!r}")
+        return batch
+
+    @staticmethod
+    def _candles_payload(df: pd.DataFrame, n: int) -> str:
+        """
+        Сериализует последние n свечей в компактный JSON-массив [o,h,l,c,v].
+        Цены округляются до шага цены инструмента, объем — до 4 знаков.
+        """
+        decimals = df.attrs.get('price_decimals', 4)
+        # Собираем массив прямо из колонок (без промежуточного DataFrame).
+        # Округляем во float64: у float32 в JSON вылезают хвосты вида 3456.1201171875
+        prices = np.column_stack([df[c].to_numpy()[-n:] for c in ("open", "high", "low", "close")])
+        volume = df['volume'].to_numpy()[-n:]
+        tail = np.column_stack([
+            np.round(prices.astype(np.float64), decimals),
+            np.round(volume.astype(np.float64), 4)
+        ])
+        # Целые цены (decimals == 0) отдаем без ".0"
+        rows = tail.tolist() if decimals else [[int(o), int(h), int(l), int(c), v] for o, h, l, c, v in tail.tolist()]
+        return orjson.dumps(rows).decode()
+
+    def _build_user_block(self, symbol: str, df: pd.DataFrame, pivots: Pivots) -> str:
+        """
+        Формирует переменную часть промпта (данные по одному тикеру).
+        """
+        # 1. Подготовка данных в текстовом виде для промпта
+        # Цена, объем и RSI последней свечи уже есть в массиве свечей и в rsi_stats
+        vol_sma = float(df['vol_sma'].iat[-1])
         
-        # Формируем CSV строку последних 40 свечей для модели
-        csv_data = df.tail(40).to_csv(index=False)
-        
-        # Helper to convert numpy types to python types for JSON serialization
-        def default(o):
-            if isinstance(o, (np.int64, np.int32)): return int(o)
-            if isinstance(o, (np.float64, np.float32)): return float(o)
-            raise TypeError
-
-        # Identified ZigZag Pivots (Local Extrema)
-        pivots_json = json.dumps(pivots[-5:], default=default) if pivots else "None"
-        
-        system_prompt = f"""
-        Ты эксперт-трейдер, специализирующийся на Волновой теории Эллиота, методе Вайкоффа и Фибоначчи.
-        
-        Задача: Проанализируй предоставленные OHLCV данные для {symbol} (1H таймфрейм) и определи, есть ли высоковероятный торговый сетап.
-        
-        Правила анализа:
-        1. **Волны Эллиота**: Определи текущую структуру. Импульс (1,3,5) или Коррекция (A,B,C). Мы ищем вход в начале 3-й или 5-й волны.
-        2. **Вайкофф**: Ищи фазы накопления/распределения. Есть ли Spring (пружина) или Upthrust (вынос)? Тест уровней.
-        3. **Фибоначчи и Уровни**: Используй уровни Фибоначчи для определения целей (TP) зоны входа.
-        4. **Индикаторы**: RSI дивергенция как подтверждение.
+        # Компактный JSON последних 40 свечей [o,h,l,c,v] вместо CSV с заголовками
+        candles_json = self._candles_payload(df, 40)
+        # Статистика хвоста считается на numpy-массивах, без промежуточных Series
+        last_ts = int(df['timestamp'].iat[-1])
+        rsi = df['rsi'].to_numpy()[-40:]
+        rsi_stats = f"min {rsi.min():.2f} / max {rsi.max():.2f} / last {rsi[-1]:.2f}"
+        # Наклон тренда: % изменения цены за свечу по линейной регрессии close
+        closes = df['close'].to_numpy(dtype=np.float64)[-40:]
+        slope_pct = np.polyfit(np.arange(len(closes)), closes, 1)[0] / closes[-1] * 100
         
-        Требования к ответу:
-        Верни СТРОГО валидный JSON следующей структуры (ключи на английском, значения reason на РУССКОМ):
-        {{
-            "signal": "LONG" | "SHORT" | "NEUTRAL",
-            "confidence": <int 1-10>,
-            "setup_name": "<string, например: Пробой 3-й волны>",
-            "entry_range": [<float min>, <float max>],
-            "stop_loss": <float price>,
-            "take_profit_1": <float price>,
-            "take_profit_2": <float price>,
-            "reasoning": "<ПОДРОБНОЕ объяснение на РУССКОМ языке. Опиши какая сейчас волна Эллиота, что происходит по Вайкоффу (фаза, тесты), есть ли дивергенция RSI. Объясни, почему выбраны именно такие уровни Stop Loss и Take Profit (уровни Фибо, хай/лоу свинга).>"
-        }}
+        # Identified ZigZag Pivots (Local Extrema); as_list() уже отдает нативные int/float,
+        # цены округлены до той же точности, что и свечи
+        decimals = df.attrs.get('price_decimals', 4)
+        pivots_json = orjson.dumps(pivots.tail(5).as_list(decimals)).decode() if len(pivots) else "None"
         
-        Важно:
-        - Если уверенность < 7, signal = "NEUTRAL".
-        - Stop Loss должен быть логичным (за лоу свинга для лонга).
-        - Risk:Reward (RR) минимум 1:2.
-        - Ответ "reasoning" должен быть детальным, чтобы пользователь понимал логику входа.
+        return USER_PROMPT_TMPL.format_map({
+            "symbol": symbol,
+            "vol_sma": vol_sma,
+            "rsi_stats": rsi_stats,
+            "slope_pct": slope_pct,
+            "last_ts": last_ts,
+            "candles_json": candles_json,
+            "pivots_json": pivots_json,
+        })
+
+    async def analyze_market_gate(self, symbol: str, df: pd.DataFrame, pivots: Pivots) -> dict:
         """
+        Короткий запрос к AI: только {signal, confidence} без подробного разбора.
 
-        user_content = f"""
-        Контекст рынка:
-        {market_summary}
-        
-        Последние свечи (Last 40):
-        {csv_data}
-        
-        Пивоты ZigZag (Локальные экстремумы):
-        {pivots_json}
+        :return: Словарь с ключами signal и confidence
+        """
+        return await self._gate(self._build_user_block(symbol, df, pivots))
+
+    async def _gate(self, user_content: str) -> dict:
+        response_text = await self._complete(
+            user_content + GATE_PROMPT,
+            gemini_config={"response_schema": GateSignal},
+            max_tokens=GATE_MAX_TOKENS
+        )
+        return orjson.loads(response_text)
+
+    @staticmethod
+    def _gate_verdict(symbol: str, gate: dict) -> dict | None:
         """
+        Решение по предварительному ответу: нейтральный сигнал, если полный анализ
+        не нужен, иначе None.
+        """
+        confidence = int(gate.get("confidence", 0))
+        if gate.get("signal") == "NEUTRAL":
+            reasoning = f"Сетап не найден: модель не видит входа (сигнал NEUTRAL, уверенность {confidence}/10)."
+        elif confidence < MIN_CONFIDENCE:
+            reasoning = f"Сетап не найден: уверенность модели {confidence}/10 ниже порога {MIN_CONFIDENCE}."
+        else:
+            return None
+        logger.info(f"⏭️ {symbol}: {gate.get('signal')} с уверенностью {confidence}, полный анализ не нужен")
+        return {"signal": "NEUTRAL", "confidence": confidence, "reasoning": reasoning}
+
+    async def _request_analysis(self, symbol: str, df: pd.DataFrame, pivots: Pivots) -> dict:
+        """
+        Формирует промпт и выполняет запрос к AI. Ошибки пробрасываются наверх.
+        Сначала короткий запрос оценивает уверенность; полный анализ с reasoning
+        запрашивается только если уверенность не ниже MIN_CONFIDENCE.
+        """
+        user_content = self._build_user_block(symbol, df, pivots)
+
+        neutral = self._gate_verdict(symbol, await self._gate(user_content))
+        if neutral is not None:
+            return neutral
         
-        try:
-            logger.info(f"🧠 Отправка данных в {'Gemini' if self.is_gemini else 'DeepSeek'} для {symbol}...")
-            
+        logger.info(f"🧠 Отправка данных в {'Gemini' if self.is_gemini else 'DeepSeek'} для {symbol}...")
+        response_text = await self._complete(user_content)
+
+        # Парсинг ответа
+        result = orjson.loads(response_text)
+        logger.info(f"✅ Анализ завершен. Сигнал: {result.get('signal')} (Conf: {result.get('confidence')})")
+        return result
+
+    async def _complete(self, user_content: str, gemini_config: dict | None = None,
+                        max_tokens: int | None = None) -> str:
+        """
+        Отправляет запрос провайдеру и возвращает текст ответа.
+        Число одновременных запросов ограничено семафором (AI_CONCURRENCY).
+
+        :param user_content: Переменная часть промпта
+        :param gemini_config: Переопределение generation_config для Gemini (например, схема)
+        :param max_tokens: Лимит токенов ответа (только DeepSeek: у Gemini 2.5 Pro
+                           в max_output_tokens входят и токены размышления, поэтому
+                           длину ответа там ограничивает схема)
+        """
+        async with self._sem:
             if self.is_gemini:
-                # Gemini требует полный промпт в одном вызове (или chat history, но тут one-shot)
-                full_gemini_prompt = system_prompt + "\n\n" + user_content
-                response = self.gemini_model.generate_content(full_gemini_prompt)
-                response_text = response.text
-            else:
-                # DeepSeek (OpenAI) использует messages
-                response = await self.deepseek_client.chat.completions.create(
-                    model="deepseek-chat",
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_content}
-                    ],
-                    response_format={"type": "json_object"},
-                    temperature=0.2
-                )
-                response_text = response.choices[0].message.content
-            
-            # Парсинг ответа
-            result = json.loads(response_text)
-            logger.info(f"✅ Анализ завершен. Сигнал: {result.get('signal')} (Conf: {result.get('confidence')})")
-            return result
-            
-        except Exception as e:
-            logger.error(f"❌ Ошибка при запросе к AI: {e}")
-            # Возвращаем безопасный нейтральный сигнал при ошибке
-            return {"signal": "NEUTRAL", "confidence": 0, "reasoning": "AI Error: " + str(e)}
+                # SYSTEM_PROMPT уже задан в модели как system_instruction
+                if gemini_config:
+                    generation_config = {**self.gemini_config, **gemini_config}
+                    response = await self.gemini_model.generate_content_async(
+                        user_content, generation_config=generation_config
+                    )
+                else:
+                    response = await self.gemini_model.generate_content_async(user_content)
+                return response.text
+
+            # DeepSeek (OpenAI) использует messages; системное сообщение побайтно
+            # одинаковое во всех запросах, что позволяет провайдеру кэшировать префикс
+            response = await self.deepseek_client.chat.completions.create(
+                model="deepseek-chat",
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": user_content}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.2,
+                **({"max_tokens": max_tokens} if max_tokens else {})
+            )
+            return response.choices[0].message.content
 
 if __name__ == "__main__":
     print("Test run requires API Key and Data.")
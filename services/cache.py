@@ -0,0 +1,111 @@
+
+import asyncio
+import inspect
+import time
+from collections import OrderedDict
+
+class AsyncTTLCache:
+    """
+    Простой in-memory кэш с временем жизни записей для asyncio-кода.
+    Параллельные запросы одного ключа ждут первый запрос, а не дублируют его.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """
+        :param maxsize: Максимальное количество записей
+        """
+        self.maxsize = maxsize
+        self._data = {}  # key -> (expiry, value)
+        self._locks = {}  # key -> asyncio.Lock
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expiry, value = entry
+        if expiry < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def _set(self, key, value, ttl: float):
+        if len(self._data) >= self.maxsize:
+            # Сначала выкидываем протухшие, затем самые старые записи
+            now = time.monotonic()
+            for k in [k for k, (exp, _) in self._data.items() if exp < now]:
+                del self._data[k]
+            while len(self._data) >= self.maxsize:
+                del self._data[next(iter(self._data))]
+        self._data[key] = (time.monotonic() + ttl, value)
+
+    async def get_or_fetch(self, key, fetch, ttl: float):
+        """
+        Возвращает значение из кэша или вызывает fetch() и сохраняет результат.
+
+        :param key: Ключ кэша (hashable)
+        :param fetch: Функция без аргументов (может вернуть awaitable)
+        :param ttl: Время жизни записи в секундах
+        """
+        value = self._get(key)
+        if value is not None:
+            return value
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Пока ждали блокировку, значение мог загрузить другой запрос
+                value = self._get(key)
+                if value is not None:
+                    return value
+
+                value = fetch()
+                if inspect.isawaitable(value):
+                    value = await value
+
+                # Пустые ответы не кэшируем, чтобы не залипнуть на ошибке сети
+                if value is not None and not getattr(value, "empty", False):
+                    self._set(key, value, ttl)
+                return value
+        finally:
+            # Замок убираем и при исключении в fetch(), иначе он останется в _locks навсегда
+            if self._locks.get(key) is lock:
+                del self._locks[key]
+
+    def invalidate(self, key=None):
+        """Удаляет запись по ключу или весь кэш."""
+        if key is None:
+            self._data.clear()
+        else:
+            self._data.pop(key, None)
+
+class LRUCache:
+    """
+    Кэш с вытеснением давно неиспользуемых записей (LRU) на OrderedDict.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        """
+        :param maxsize: Максимальное количество записей
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """Возвращает значение и помечает запись как свежую."""
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key, value):
+        """Сохраняет значение, вытесняя самую старую запись при переполнении."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
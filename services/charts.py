@@ -1,28 +1,61 @@
 
+import asyncio
+import threading
 import pandas as pd
+import matplotlib
+# Графики рисуются в рабочем потоке — нужен неинтерактивный backend (GUI-backend'ы
+# вроде macosx/TkAgg не позволяют создавать фигуры вне главного потока)
+matplotlib.use("Agg")
 import mplfinance as mpf
 import io
 
+from services.cache import LRUCache
+from services.indicators import Pivots
+
 class ChartGenerator:
     """
     Генератор графиков для отправки в Telegram.
     Использует библиотеку mplfinance для рисования японских свечей.
     """
-    
-    @staticmethod
-    def generate_chart(df: pd.DataFrame, symbol: str, interval: str, pivots: list = None, support_resistance: list = None) -> io.BytesIO:
+
+    def __init__(self, cache_size: int = 256):
+        """
+        :param cache_size: Сколько отрисованных PNG держать в памяти
+        """
+        # PNG-байты по (тикер, таймфрейм, время и цена закрытия последней свечи)
+        self._cache = LRUCache(maxsize=cache_size)
+        # pyplot хранит глобальное состояние — рисуем по одному графику за раз
+        self._render_lock = threading.Lock()
+
+    async def generate_chart(self, df: pd.DataFrame, symbol: str, interval: str, pivots: Pivots = None, support_resistance: list = None) -> bytes | None:
         """
         Рисует график свечей и наносит разметку.
+        Пока последняя свеча не изменилась, возвращает PNG из кэша;
+        отрисовка выполняется в отдельном потоке, чтобы не блокировать event loop.
         
         :param df: DataFrame с данными
         :param symbol: Тикер
         :param interval: Таймфрейм
         :param pivots: (Опционально) Точки ZigZag для отрисовки линий
-        :return: Байтовый буфер с картинкой (PNG)
+        :return: Картинка (PNG) в байтах или None при ошибке
+        """
+        last = df.iloc[-1]
+        # Цена закрытия в ключе: незакрытая свеча меняется, пока не закроется
+        key = (symbol, interval, int(last['timestamp']), float(last['close']))
+        chart_bytes = self._cache.get(key)
+        if chart_bytes is None:
+            chart_bytes = await asyncio.to_thread(self._render, df, symbol, interval)
+            if chart_bytes is not None:
+                self._cache.set(key, chart_bytes)
+        return chart_bytes
+
+    def _render(self, df: pd.DataFrame, symbol: str, interval: str) -> bytes | None:
+        """
+        Синхронная отрисовка графика через mplfinance.
         """
-        # mplfinance требует индекс DateTimeIndex
-        plot_df = df.copy()
-        plot_df.set_index('datetime', inplace=True)
+        # mplfinance требует индекс DateTimeIndex; берем только OHLCV,
+        # set_index возвращает новый фрейм без полного копирования исходного df
+        plot_df = df[['datetime', 'open', 'high', 'low', 'close', 'volume']].set_index('datetime')
         
         # Настройка стиля
         s = mpf.make_mpf_style(base_mpf_style='charles', rc={'font.size': 8})
@@ -33,17 +66,17 @@ class ChartGenerator:
         title = f"{symbol} Analysis ({interval}) - Hyperliquid Data"
         
         try:
-            mpf.plot(
-                plot_df,
-                type='candle',
-                volume=True,
-                title=title,
-                style=s,
-                savefig=dict(fname=buf, dpi=100, bbox_inches='tight'),
-                warn_too_much_data=1000  # Suppress warnings
-            )
-            buf.seek(0)
-            return buf
+            with self._render_lock:
+                mpf.plot(
+                    plot_df,
+                    type='candle',
+                    volume=True,
+                    title=title,
+                    style=s,
+                    savefig=dict(fname=buf, dpi=100, bbox_inches='tight'),
+                    warn_too_much_data=1000  # Suppress warnings
+                )
+            return buf.getvalue()
         except Exception as e:
             print(f"❌ Ошибка генерации графика: {e}")
             return None
@@ -1,7 +1,272 @@
 
+import asyncio
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from hashlib import blake2b
 import pandas as pd
 import numpy as np
 
+from services._njit import njit, HAS_NUMBA
+from services.cache import LRUCache
+
+# Без Numba сглаживание RSI считается линейным фильтром SciPy (на C), если он установлен
+lfilter = None
+if not HAS_NUMBA:
+    try:
+        from scipy.signal import lfilter
+    except ImportError:
+        pass
+
+# Пул процессов для пакетного расчета индикаторов (создается при первом использовании)
+_POOL = None
+_WORKERS = os.cpu_count() or 1
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _POOL
+    if _POOL is None:
+        # fork из процесса с потоками (WebSocket, httpx, пул потоков asyncio) может
+        # зависнуть на чужой блокировке — воркеры запускаются через forkserver/spawn
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _POOL = ProcessPoolExecutor(max_workers=_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _POOL
+
+# Результаты add_all_indicators по содержимому свечей (вызывается из потоков, поэтому под замком)
+_RESULTS = LRUCache(maxsize=64)
+_RESULTS_LOCK = threading.Lock()
+
+def _frame_key(df: pd.DataFrame) -> tuple:
+    """
+    Ключ кэша индикаторов: длина, первая метка индекса и blake2b от timestamp + OHLCV.
+    """
+    h = blake2b(digest_size=16)
+    for col in ('timestamp', 'open', 'high', 'low', 'close', 'volume'):
+        h.update(np.ascontiguousarray(df[col].to_numpy()).tobytes())
+    return len(df), df.index[0], h.digest()
+
+def _price_values(series: pd.Series) -> np.ndarray:
+    """
+    Массив цен для ядер: float32/float64 передаются как есть (без копии),
+    остальные типы приводятся к float64.
+    """
+    if series.dtype in (np.float32, np.float64):
+        return series.to_numpy()
+    return series.to_numpy(dtype=np.float64)
+
+# Явные сигнатуры: Numba компилирует ядра сразу при импорте модуля (а с cache=True
+# берет готовый код из __pycache__), поэтому первый запрос не ждет JIT-компиляцию.
+# Вход — read-only массив float32 (свечи хранятся в float32) или float64:
+# pandas с Copy-on-Write отдает из to_numpy() неизменяемые представления,
+# а обычные массивы Numba к такому типу приводит сама.
+# Внутри ядер арифметика и накопление идут во float64
+if HAS_NUMBA:
+    from numba import types
+
+    _PRICE_IN = [types.Array(t, 1, 'A', readonly=True) for t in (types.float32, types.float64)]
+    _ZIGZAG_SIG = [
+        types.Tuple((types.int64[::1], types.float64[::1], types.int8[::1]))(arr, types.float64)
+        for arr in _PRICE_IN
+    ]
+    _RSI_SIG = [types.float64[::1](arr, types.int64) for arr in _PRICE_IN]
+else:
+    _ZIGZAG_SIG = _RSI_SIG = None
+
+@njit(_ZIGZAG_SIG, cache=True)
+def _zigzag_loop(closes, deviation_percent):
+    """
+    Ядро ZigZag (компилируется Numba). Возвращает параллельные массивы
+    (индексы, цены, типы), где тип 1 — пик, -1 — дно.
+    """
+    n = len(closes)
+    idx_out = np.empty(n, dtype=np.int64)
+    price_out = np.empty(n, dtype=np.float64)
+    type_out = np.empty(n, dtype=np.int8)
+    count = 0
+
+    last_pivot_price = np.float64(closes[0])
+    last_pivot_idx = 0
+    trend = 0 # 0 - не определен, 1 - вверх, -1 - вниз
+
+    for i in range(1, n):
+        price = np.float64(closes[i])
+        # Изменение цены в процентах от прошлого пивота
+        change = (price - last_pivot_price) / last_pivot_price * 100
+
+        if trend == 0:
+            # Инициализация первого движения
+            if change >= deviation_percent:
+                trend = 1
+                last_pivot_price = price
+                last_pivot_idx = i
+            elif change <= -deviation_percent:
+                trend = -1
+                last_pivot_price = price
+                last_pivot_idx = i
+        else:
+            # Тренд определен: sign = 1 (вверх) или -1 (вниз).
+            # Обновление экстремума без ветвления — выбор арифметикой по флагу
+            sign = trend
+            better = 1.0 if sign * (price - last_pivot_price) > 0.0 else 0.0
+            flipped = sign * change <= -deviation_percent
+            last_pivot_price = better * price + (1.0 - better) * last_pivot_price
+            last_pivot_idx = int(better * i + (1.0 - better) * last_pivot_idx)
+
+            # Единственная ветка — разворот: фиксируем пик (sign=1) или дно (sign=-1)
+            if flipped and better == 0.0:
+                idx_out[count] = last_pivot_idx
+                price_out[count] = last_pivot_price
+                type_out[count] = sign
+                count += 1
+                trend = -sign
+                last_pivot_price = price
+                last_pivot_idx = i
+
+    # Добавляем последнюю известную точку как потенциальный пивот
+    idx_out[count] = last_pivot_idx
+    price_out[count] = last_pivot_price
+    type_out[count] = 1 if trend == 1 else -1
+    count += 1
+
+    return idx_out[:count], price_out[:count], type_out[:count]
+
+@njit(_RSI_SIG, cache=True, fastmath=True)
+def _rsi_wilder(close, period):
+    """
+    RSI Уайлдера за один проход по ценам (компилируется Numba).
+    Средние рост/падение стартуют с простого среднего первых period разниц цен,
+    дальше сглаживаются рекурсией Уайлдера (EMA с alpha=1/period);
+    первые period значений — 50 (нейтрально).
+    """
+    n = len(close)
+    out = np.full(n, 50.0)
+    avg_gain = 0.0
+    avg_loss = 0.0
+
+    for i in range(1, n):
+        delta = np.float64(close[i]) - np.float64(close[i - 1])
+        gain = delta if delta > 0.0 else 0.0
+        loss = -delta if delta < 0.0 else 0.0
+
+        if i <= period:
+            # Накопление суммы для начального SMA
+            avg_gain += gain
+            avg_loss += loss
+            if i < period:
+                continue
+            avg_gain /= period
+            avg_loss /= period
+        else:
+            avg_gain = (avg_gain * (period - 1) + gain) / period
+            avg_loss = (avg_loss * (period - 1) + loss) / period
+
+        if avg_loss > 0.0:
+            out[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+        elif avg_gain > 0.0:
+            out[i] = 100.0
+
+    return out
+
+def _wilder_smooth(values: np.ndarray, period: int) -> np.ndarray:
+    """
+    Сглаживание Уайлдера без Python-цикла: values[0] — начальное SMA,
+    дальше y[i] = y[i-1] + (values[i] - y[i-1]) / period.
+    Через scipy.signal.lfilter, а без SciPy — через pandas ewm(adjust=False).
+    """
+    alpha = 1.0 / period
+    if lfilter is None:
+        return pd.Series(values).ewm(alpha=alpha, adjust=False).mean().to_numpy()
+    out = np.empty_like(values)
+    out[0] = values[0]
+    out[1:] = lfilter([alpha], [1.0, alpha - 1.0], values[1:], zi=[(1.0 - alpha) * values[0]])[0]
+    return out
+
+def _rsi_vectorized(close: np.ndarray, period: int) -> np.ndarray:
+    """
+    Тот же RSI, что и _rsi_wilder, векторными операциями — для запуска без Numba.
+    """
+    close = close.astype(np.float64, copy=False)
+    n = len(close)
+    out = np.full(n, 50.0)
+    if n <= period:
+        return out
+
+    delta = np.diff(close)
+    gain = np.where(delta > 0.0, delta, 0.0)
+    loss = np.where(delta < 0.0, -delta, 0.0)
+
+    # Начальное SMA первых period разниц, затем рекурсия по остальным
+    avg_gain = _wilder_smooth(np.concatenate(([gain[:period].mean()], gain[period:])), period)
+    avg_loss = _wilder_smooth(np.concatenate(([loss[:period].mean()], loss[period:])), period)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsi = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+    rsi = np.where(avg_loss > 0.0, rsi, np.where(avg_gain > 0.0, 100.0, 50.0))
+    out[period:] = rsi
+    return out
+
+def _moving_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """
+    Скользящее среднее через префиксные суммы (один проход на C, без Rolling-объекта).
+    Первые window-1 значений — NaN, как у Series.rolling(window).mean().
+    """
+    values = np.asarray(values, dtype=np.float64)
+    out = np.full(len(values), np.nan)
+    if len(values) >= window:
+        csum = np.cumsum(values)
+        out[window - 1] = csum[window - 1]
+        out[window:] = csum[window:] - csum[:-window]
+        out[window - 1:] /= window
+    return out
+
+@dataclass(eq=False)
+class Pivots:
+    """
+    Точки ZigZag в виде параллельных массивов (SoA): одна непрерывная
+    numpy-колонка на поле вместо списка словарей.
+    """
+    indices: np.ndarray # int64, позиция свечи в DataFrame
+    prices: np.ndarray  # float64, цена пивота
+    types: np.ndarray   # int8, 1 - пик, -1 - дно
+    times: np.ndarray   # int64, timestamp свечи (unix ms)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __eq__(self, other) -> bool:
+        # Сгенерированный dataclass __eq__ сравнивал бы массивы через ==
+        # (ValueError: truth value of an array is ambiguous)
+        if not isinstance(other, Pivots):
+            return NotImplemented
+        return (np.array_equal(self.indices, other.indices) and np.array_equal(self.prices, other.prices)
+                and np.array_equal(self.types, other.types) and np.array_equal(self.times, other.times))
+
+    def tail(self, n: int) -> "Pivots":
+        """Последние n пивотов."""
+        return Pivots(self.indices[-n:], self.prices[-n:], self.types[-n:], self.times[-n:])
+
+    def as_list(self, decimals: int | None = None) -> list[dict]:
+        """
+        Совместимый формат: список словарей [{'index', 'price', 'type', 'time'}].
+        Значения — нативные Python int/float (через tolist), без numpy-скаляров.
+
+        :param decimals: Округлить цены до стольких знаков (None — без округления)
+        """
+        # Цены пивотов приходят из float32-свечей: без округления в JSON попадают
+        # хвосты вида 3609.779541015625
+        prices = self.prices if decimals is None else np.round(self.prices, decimals)
+        return [
+            {
+                'index': idx,
+                'price': price,
+                'type': 'peak' if t == 1 else 'valley',
+                'time': ts
+            }
+            for idx, price, t, ts in zip(self.indices.tolist(), prices.tolist(), self.types.tolist(), self.times.tolist())
+        ]
+
 class IndicatorEngine:
     """
     Движок для расчета технических индикаторов (RSI, ZigZag, Volume SMA).
@@ -11,127 +276,125 @@ class IndicatorEngine:
     @staticmethod
     def calculate_rsi(df: pd.DataFrame, period: int = 14) -> pd.Series:
         """
-        Расчет индекса относительной силы (RSI).
+        Расчет индекса относительной силы (RSI) со сглаживанием Уайлдера.
         
         :param df: DataFrame с колонкой 'close'
         :param period: Период расчета (стандарт 14)
         :return: Series со значениями RSI
         """
-        # Вычисляем разницу цен закрытия
-        delta = df['close'].diff()
-        
-        # Разделяем на рост (gain) и падение (loss)
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-
-        # Формула RSI
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        
-        # Заполняем пропуски (первые 14 свечей) значением 50 (нейтрально)
-        return rsi.fillna(50)
+        # delta -> gain/loss -> сглаживание -> RSI за один проход в скомпилированном ядре
+        close = _price_values(df['close'])
+        if HAS_NUMBA:
+            rsi = _rsi_wilder(close, int(period))
+        else:
+            # Без Numba цикл ядра шел бы в интерпретаторе — считаем векторно
+            rsi = _rsi_vectorized(close, int(period))
+        return pd.Series(rsi, index=df.index)
 
     @staticmethod
-    def calculate_zigzag(df: pd.DataFrame, deviation_percent: float = 1.0) -> list:
+    def calculate_zigzag(df: pd.DataFrame, deviation_percent: float = 1.0) -> Pivots:
         """
         Алгоритм ZigZag для поиска локальных экстремумов (вершин и впадин).
         Помогает ИИ визуально определять волны Эллиотта.
         
         :param df: DataFrame с ценами
         :param deviation_percent: Минимальное отклонение в % для фиксации разворота
-        :return: Список словарей [{'index', 'price', 'type', 'time'}]
+        :return: Pivots (параллельные массивы индексов, цен, типов и времени)
         """
-        closes = df['close'].values
-        timestamps = df['timestamp'].values
-        
-        pivots = [] # Здесь будем хранить найденные точки
+        # Основной цикл выполняется в скомпилированном ядре
+        idx_arr, price_arr, type_arr = _zigzag_loop(_price_values(df['close']), float(deviation_percent))
         
-        last_pivot_price = closes[0]
-        last_pivot_idx = 0
-        trend = 0 # 0 - не определен, 1 - вверх, -1 - вниз
-        
-        for i in range(1, len(closes)):
-            price = closes[i]
-            # Изменение цены в процентах от прошлого пивота
-            change = (price - last_pivot_price) / last_pivot_price * 100
-            
-            if trend == 0:
-                # Инициализация первого движения
-                if change >= deviation_percent:
-                    trend = 1
-                    last_pivot_price = price
-                    last_pivot_idx = i
-                elif change <= -deviation_percent:
-                    trend = -1
-                    last_pivot_price = price
-                    last_pivot_idx = i
-            elif trend == 1:
-                # Если идем вверх и цена стала еще выше — обновляем хай
-                if price > last_pivot_price:
-                    last_pivot_price = price
-                    last_pivot_idx = i
-                # Если цена упала больше чем на deviation — фиксируем вершину и меняем тренд
-                elif change <= -deviation_percent:
-                    pivots.append({
-                        'index': last_pivot_idx, 
-                        'price': last_pivot_price, 
-                        'type': 'peak', 
-                        'time': timestamps[last_pivot_idx]
-                    })
-                    trend = -1
-                    last_pivot_price = price
-                    last_pivot_idx = i
-            elif trend == -1:
-                # Если идем вниз и цена стала еще ниже — обновляем лоу
-                if price < last_pivot_price:
-                    last_pivot_price = price
-                    last_pivot_idx = i
-                # Если цена выросла больше чем на deviation — фиксируем дно и меняем тренд
-                elif change >= deviation_percent:
-                    pivots.append({
-                        'index': last_pivot_idx, 
-                        'price': last_pivot_price, 
-                        'type': 'valley', 
-                        'time': timestamps[last_pivot_idx]
-                    })
-                    trend = 1
-                    last_pivot_price = price
-                    last_pivot_idx = i
-                    
-        # Добавляем последнюю известную точку как потенциальный пивот
-        pivots.append({
-            'index': last_pivot_idx, 
-            'price': last_pivot_price, 
-            'type': 'peak' if trend == 1 else 'valley', 
-            'time': timestamps[last_pivot_idx]
-        })
+        return Pivots(
+            indices=idx_arr,
+            prices=price_arr,
+            types=type_arr,
+            times=df['timestamp'].to_numpy()[idx_arr]
+        )
+
+    @staticmethod
+    def price_decimals(price: float) -> int:
+        """
+        Количество знаков после запятой для цены инструмента.
+        Цены на Hyperliquid ограничены 5 значащими цифрами.
         
-        return pivots
+        :param price: Текущая цена
+        :return: Число знаков (0..8)
+        """
+        if not price > 0:
+            return 4
+        return int(min(8, max(0, 4 - math.floor(math.log10(price)))))
 
     @staticmethod
-    def add_all_indicators(df: pd.DataFrame) -> tuple[pd.DataFrame, list]:
+    def add_all_indicators(df: pd.DataFrame) -> tuple[pd.DataFrame, Pivots]:
         """
         Метод-обертка для расчета всех индикаторов разом.
+        Результат кэшируется по содержимому свечей: повторный вызов на тех же данных
+        возвращает тот же DataFrame — не изменяйте его.
         """
-        df = df.copy()
-        
+        key = _frame_key(df)
+        with _RESULTS_LOCK:
+            cached = _RESULTS.get(key)
+        if cached is not None:
+            return cached
+
+        # Индикаторы только читают close/volume/timestamp, поэтому входной DataFrame
+        # не копируется: новые колонки добавляются в результат через assign
+        # Индикаторы считаются во float64 — возвращаем результат к типу входных цен
+        dtype = df['close'].dtype
+
         # 1. RSI
-        df['rsi'] = IndicatorEngine.calculate_rsi(df)
+        rsi = IndicatorEngine.calculate_rsi(df).to_numpy().astype(dtype)
         
         # 2. SMA Объема (20 периодов) - чтобы видеть всплески
-        df['vol_sma'] = df['volume'].rolling(window=20).mean()
+        vol_sma = _moving_mean(df['volume'].to_numpy(), 20).astype(dtype)
         
         # 3. ZigZag (считаем, но в DataFrame пишем только флаги)
-        df['is_pivot'] = 0 # 0 - нет, 1 - пик, -1 - дно
         pivots = IndicatorEngine.calculate_zigzag(df)
         
-        # Интегрируем пивоты в DataFrame
-        for p in pivots:
-            idx = p['index']
-            # Проверяем, не выходит ли индекс за границы (на случай ошибок)
-            if idx < len(df):
-                val = 1 if p['type'] == 'peak' else -1
-                # is_pivot колонка, строка idx
-                df.iloc[idx, df.columns.get_loc('is_pivot')] = val
-                
+        # Интегрируем пивоты в DataFrame одной записью по массиву индексов
+        is_pivot = np.zeros(len(df), dtype=np.int8) # 0 - нет, 1 - пик, -1 - дно
+        is_pivot[pivots.indices] = pivots.types
+
+        df = df.assign(rsi=rsi, vol_sma=vol_sma, is_pivot=is_pivot)
+
+        # 4. Точность цены (для компактной сериализации свечей в промпт)
+        df.attrs['price_decimals'] = IndicatorEngine.price_decimals(float(df['close'].iat[-1]))
+
+        with _RESULTS_LOCK:
+            _RESULTS.set(key, (df, pivots))
         return df, pivots
+
+    @staticmethod
+    def add_all_indicators_batch(frames: dict[str, pd.DataFrame]) -> dict[str, tuple[pd.DataFrame, Pivots]]:
+        """
+        Расчет индикаторов для нескольких тикеров параллельно в пуле процессов
+        (numpy/Numba-код держит GIL, потоки тут не помогают).
+        
+        :param frames: Словарь {тикер: DataFrame свечей}
+        :return: Словарь {тикер: (DataFrame с индикаторами, Pivots)}
+        """
+        if len(frames) < 2:
+            return {symbol: IndicatorEngine.add_all_indicators(df) for symbol, df in frames.items()}
+        # Порции по несколько тикеров имеют смысл только когда тикеров намного больше воркеров,
+        # иначе все уйдет в один процесс
+        chunksize = max(1, len(frames) // (_WORKERS * 4))
+        results = _get_pool().map(IndicatorEngine.add_all_indicators, frames.values(), chunksize=chunksize)
+        return dict(zip(frames.keys(), results))
+
+    @staticmethod
+    async def add_all_indicators_batch_async(frames: dict[str, pd.DataFrame]) -> dict[str, tuple[pd.DataFrame, Pivots]]:
+        """
+        Асинхронный вариант add_all_indicators_batch: event loop не блокируется,
+        каждый тикер считается отдельной задачей в пуле процессов.
+
+        :param frames: Словарь {тикер: DataFrame свечей}
+        :return: Словарь {тикер: (DataFrame с индикаторами, Pivots)}
+        """
+        if len(frames) < 2:
+            return await asyncio.to_thread(IndicatorEngine.add_all_indicators_batch, frames)
+        loop = asyncio.get_running_loop()
+        pool = _get_pool()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(pool, IndicatorEngine.add_all_indicators, df) for df in frames.values())
+        )
+        return dict(zip(frames.keys(), results))
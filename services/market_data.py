@@ -1,41 +1,333 @@
 
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+import httpx
+import numpy as np
 import pandas as pd
 from hyperliquid.info import Info
+from hyperliquid.websocket_manager import WebsocketManager
 from hyperliquid.utils import constants
 
+from services.cache import AsyncTTLCache
+
+# Длительность свечи в миллисекундах для поддерживаемых таймфреймов
+INTERVAL_MS = {
+    "1m": 60 * 1000,
+    "5m": 5 * 60 * 1000,
+    "15m": 15 * 60 * 1000,
+    "1h": 3600 * 1000,
+    "4h": 4 * 3600 * 1000,
+    "1d": 24 * 3600 * 1000,
+}
+
+# Колонки кольцевого буфера свечей (все хранятся как float64)
+CANDLE_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# Минимальная емкость буфера свечей для одной пары (symbol, interval)
+STREAM_CAPACITY = 1000
+
+# Сколько пар одновременно держать подписанными на WebSocket (Hyperliquid
+# ограничивает число подписок с одного IP); давно не запрашиваемые отписываются
+MAX_STREAMS = 32
+
+# Буфер отдается, только если сообщения WebSocket приходили не позже чем
+# min(длительность свечи, STREAM_MAX_SILENCE) секунд назад
+STREAM_MAX_SILENCE = 60
+
+class _CandleRing:
+    """
+    Буфер последних свечей одной пары, обновляемый из WebSocket.
+    Массив выделяется один раз с двойным запасом: новые свечи дописываются в конец,
+    а при заполнении последние capacity строк сдвигаются в начало (амортизированно O(1)).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.data = np.empty((capacity * 2, len(CANDLE_COLUMNS)), dtype=np.float64)
+        self.size = 0
+        # Время последних данных (time.monotonic): сообщения WebSocket или загрузка по HTTP
+        self.last_update = float("-inf")
+        # Пока идет загрузка по HTTP, сообщения WebSocket копятся в pending
+        # и применяются поверх снапшота, чтобы он не затер более новые данные
+        self.loading = False
+        self.pending = []
+        self.subscription_id = None
+
+    def load(self, df: pd.DataFrame):
+        """Заполняет буфер свечами из HTTP-снапшота и применяет накопленные сообщения."""
+        rows = df[CANDLE_COLUMNS].to_numpy(dtype=np.float64)[-self.capacity:]
+        self.data[:len(rows)] = rows
+        self.size = len(rows)
+        for row in self.pending:
+            self.update(row)
+        self.pending = []
+        self.loading = False
+        self.last_update = time.monotonic()
+
+    def update(self, row):
+        """Обновляет текущую свечу или дописывает новую (старые сообщения игнорируются)."""
+        last_ts = self.data[self.size - 1, 0] if self.size else -1.0
+        if row[0] == last_ts:
+            self.data[self.size - 1] = row
+        elif row[0] > last_ts:
+            if self.size == len(self.data):
+                self.data[:self.capacity] = self.data[self.size - self.capacity:self.size]
+                self.size = self.capacity
+            self.data[self.size] = row
+            self.size += 1
+
+    def tail(self, limit: int) -> np.ndarray:
+        """Копия последних limit свечей."""
+        return self.data[max(0, self.size - limit):self.size].copy()
+
 class MarketDataService:
     """
     Сервис для работы с рыночными данными (свечи, цены) через Hyperliquid API.
     """
+
+    # Общий HTTP/2-клиент для всех экземпляров: одно соединение обслуживает
+    # параллельные запросы (мультиплексирование), keep-alive без повторных handshake
+    _client: httpx.Client | None = None
+
+    @classmethod
+    def _shared_client(cls) -> httpx.Client:
+        if cls._client is None:
+            cls._client = httpx.Client(
+                http2=True,
+                limits=httpx.Limits(max_keepalive_connections=32, keepalive_expiry=60),
+                headers={"Content-Type": "application/json"}
+            )
+        return cls._client
     
-    def __init__(self, base_url=constants.MAINNET_API_URL):
+    def __init__(self, base_url=constants.MAINNET_API_URL, stream: bool = True):
         """
         Инициализация подключения к Info API.
         
         :param base_url: URL API (Mainnet или Testnet)
+        :param stream: Обновлять свечи через WebSocket (False — только HTTP).
+                       Соединение открывается при первом запросе свечей, не в конструкторе
         """
-        # skip_ws=True отключает WebSocket, используем только HTTP для запросов
+        self.stream = stream
+        # WebSocket SDK запускаем сами (см. _ensure_ws), поэтому skip_ws=True
         self.info = Info(base_url=base_url, skip_ws=True)
+        # SDK вызывает только session.post(url, json=..., timeout=...) и читает
+        # status_code/text/headers/json() — httpx.Client совместим с этим интерфейсом
+        self.info.session.close()
+        self.info.session = self._shared_client()
+        # Кэш свечей: повторные запросы в пределах полсвечи не ходят в API
+        self._cache = AsyncTTLCache(maxsize=512)
+        # Буферы свечей по (symbol, interval) в порядке последнего обращения (LRU),
+        # обновляются из потока WebSocket
+        self._buffers: OrderedDict[tuple[str, str], _CandleRing] = OrderedDict()
+        self._buffers_lock = threading.Lock()
+        # Загрузка снапшота для пары идет одна, параллельные запросы ее ждут
+        self._bootstrap_locks: dict[tuple[str, str], asyncio.Lock] = {}
+
+    def close(self):
+        """Отключает WebSocket и закрывает общий HTTP-клиент (вызывать при остановке бота)."""
+        if self.info.ws_manager is not None:
+            self.info.disconnect_websocket()
+            self.info.ws_manager = None
+        cls = type(self)
+        if cls._client is not None:
+            cls._client.close()
+            cls._client = None
 
-    def get_candles(self, symbol: str, interval: str = "5m", limit: int = 100) -> pd.DataFrame:
+    async def get_candles(self, symbol: str, interval: str = "5m", limit: int = 100) -> pd.DataFrame:
         """
         Получает исторические свечи (OHLCV) для указанной пары.
+        Первый запрос пары загружает свечи по HTTP и подписывает ее на WebSocket,
+        дальше данные берутся из буфера без обращения к API, пока поток живой.
+        Без WebSocket результат кэшируется на половину длительности свечи, HTTP-запрос
+        выполняется в отдельном потоке, чтобы не блокировать event loop.
+        Возвращаемый DataFrame общий для всех вызывающих — не изменяйте его.
 
         :param symbol: Тикер (например, 'ETH' или 'BTC')
         :param interval: Таймфрейм ('15m', '1h', '4h')
         :param limit: Количество свечей (по умолчанию 100)
         :return: DataFrame с колонками [timestamp, open, high, low, close, volume, datetime]
         """
+        interval_ms = INTERVAL_MS.get(interval, INTERVAL_MS["1h"])
+        if self.stream:
+            df = self._stream_candles(symbol, interval, limit, interval_ms)
+            if df is not None:
+                return df
+            return await self._bootstrap_stream(symbol, interval, limit, interval_ms)
+        return await self._cached_candles(symbol, interval, limit, interval_ms)
+
+    async def _cached_candles(self, symbol: str, interval: str, limit: int, interval_ms: int) -> pd.DataFrame:
+        """Загрузка по HTTP через кэш на половину длительности свечи."""
+        return await self._cache.get_or_fetch(
+            (symbol, interval, limit),
+            lambda: asyncio.to_thread(self._fetch_candles, symbol, interval, limit),
+            ttl=interval_ms / 2000
+        )
+
+    def _stream_candles(self, symbol: str, interval: str, limit: int, interval_ms: int) -> pd.DataFrame | None:
+        """
+        Свечи из WebSocket-буфера. None, если поток не работает, буфера нет, в нем мало свечей
+        или данные устарели (тогда нужна свежая загрузка по HTTP).
+        """
+        ws = self.info.ws_manager
+        if ws is None or not ws.is_alive():
+            return None
+
+        key = (symbol, interval)
+        with self._buffers_lock:
+            ring = self._buffers.get(key)
+            if ring is None or ring.loading or ring.size < limit:
+                return None
+            # Сообщений давно не было — подписка могла отвалиться
+            if time.monotonic() - ring.last_update > min(interval_ms / 1000, STREAM_MAX_SILENCE):
+                return None
+            self._buffers.move_to_end(key)
+            rows = ring.tail(limit)
+
+        # Последняя свеча должна быть текущей (открыта меньше интервала назад)
+        if rows[-1, 0] < time.time() * 1000 - interval_ms:
+            return None
+
+        df = pd.DataFrame(rows, columns=CANDLE_COLUMNS)
+        df['timestamp'] = df['timestamp'].astype('int64')
+        numeric_cols = ['open', 'high', 'low', 'close', 'volume']
+        df[numeric_cols] = df[numeric_cols].astype('float32')
+        df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
+        return df
+
+    async def _bootstrap_stream(self, symbol: str, interval: str, limit: int, interval_ms: int) -> pd.DataFrame:
+        """
+        Свежая загрузка свечей по HTTP (мимо кэша) с заполнением буфера пары.
+        Подписка оформляется до запроса: сообщения, пришедшие во время загрузки,
+        применяются поверх снапшота.
+        """
+        key = (symbol, interval)
+        lock = self._bootstrap_locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                # Пока ждали, буфер мог заполнить параллельный запрос
+                df = self._stream_candles(symbol, interval, limit, interval_ms)
+                if df is not None:
+                    return df
+
+                # Неизвестный тикер (любой текст от пользователя) не подписываем:
+                # SDK падает на нем с KeyError, а HTTP-путь вернет пустой DataFrame
+                if symbol not in self.info.name_to_coin:
+                    return await self._cached_candles(symbol, interval, limit, interval_ms)
+
+                try:
+                    self._ensure_ws()
+                    with self._buffers_lock:
+                        ring = self._buffers.get(key)
+                        if ring is None or ring.capacity < limit:
+                            ring = self._add_buffer(key, max(limit, STREAM_CAPACITY))
+                        ring.loading = True
+                except Exception as e:
+                    print(f"⚠️ Не удалось подписаться на свечи {symbol} ({interval}), загружаю по HTTP: {e}")
+                    return await self._cached_candles(symbol, interval, limit, interval_ms)
+
+                df = await asyncio.to_thread(self._fetch_candles, symbol, interval, limit)
+
+                with self._buffers_lock:
+                    if df.empty:
+                        # Неизвестный тикер или ошибка сети — подписку не держим
+                        self._drop_buffer(key)
+                    else:
+                        ring.load(df)
+                return df
+        finally:
+            if self._bootstrap_locks.get(key) is lock:
+                del self._bootstrap_locks[key]
+
+    def _ensure_ws(self):
+        """
+        Запускает WebSocket при первом использовании или пересоздает его, если поток
+        завершился (SDK не переподключается сам), и заново подписывает все пары.
+        """
+        ws = self.info.ws_manager
+        if ws is not None and ws.is_alive():
+            return
+        if ws is not None:
+            print("⚠️ WebSocket отключился, переподключаюсь...")
+            try:
+                ws.stop()
+            except Exception as e:
+                print(f"❌ Ошибка при остановке WebSocket: {e}")
+
+        ws = WebsocketManager(self.info.base_url)
+        # Потоки SDK не daemon — без этого они не дают процессу завершиться
+        ws.daemon = True
+        ws.ping_sender.daemon = True
+        ws.start()
+        self.info.ws_manager = ws
+
+        with self._buffers_lock:
+            for key, ring in self._buffers.items():
+                # Данные за время обрыва потеряны — буфер будет перезагружен по HTTP
+                ring.last_update = float("-inf")
+                ring.subscription_id = self.info.subscribe(self._subscription(key), self._on_candle)
+
+    @staticmethod
+    def _subscription(key: tuple[str, str]) -> dict:
+        symbol, interval = key
+        return {"type": "candle", "coin": symbol, "interval": interval}
+
+    def _add_buffer(self, key: tuple[str, str], capacity: int) -> _CandleRing:
+        """
+        Создает буфер пары и подписывает ее (вызывать под _buffers_lock).
+        При превышении MAX_STREAMS отписывает давно не запрашиваемую пару —
+        только после успешной подписки новой.
+        """
+        ring = _CandleRing(capacity)
+        old = self._buffers.get(key)
+        if old is not None:
+            ring.subscription_id = old.subscription_id
+            del self._buffers[key]
+        else:
+            ring.subscription_id = self.info.subscribe(self._subscription(key), self._on_candle)
+            while len(self._buffers) >= MAX_STREAMS:
+                self._drop_buffer(next(iter(self._buffers)))
+        self._buffers[key] = ring
+        return ring
+
+    def _drop_buffer(self, key: tuple[str, str]):
+        """Удаляет буфер пары и отписывается от нее (вызывать под _buffers_lock)."""
+        ring = self._buffers.pop(key, None)
+        if ring is None or ring.subscription_id is None:
+            return
+        try:
+            self.info.unsubscribe(self._subscription(key), ring.subscription_id)
+        except Exception as e:
+            # До установки соединения SDK не умеет отписываться — подписка останется в очереди
+            print(f"⚠️ Не удалось отписаться от {key}: {e}")
+
+    def _on_candle(self, msg):
+        """
+        Обработчик сообщений WebSocket (вызывается из потока SDK).
+        Формат: {"channel": "candle", "data": {"t", "T", "s", "i", "o", "c", "h", "l", "v", "n"}}
+        """
+        c = msg["data"]
+        row = (float(c["t"]), float(c["o"]), float(c["h"]), float(c["l"]), float(c["c"]), float(c["v"]))
+        with self._buffers_lock:
+            ring = self._buffers.get((c["s"], c["i"]))
+            if ring is None:
+                return
+            if ring.loading:
+                ring.pending.append(row)
+            else:
+                ring.update(row)
+                ring.last_update = time.monotonic()
+
+    def _fetch_candles(self, symbol: str, interval: str, limit: int) -> pd.DataFrame:
+        """
+        Синхронная загрузка свечей через SDK (без кэша).
+        """
         print(f"🔄 Загружаю {limit} свечей для {symbol} ({interval})...")
         try:
-            import time
             end_time = int(time.time() * 1000)
             # Приблизительный расчет времени старта (с запасом)
-            # 1h = 3600*1000, 4h = ...
-            # Для простоты берем интервал в миллисекундах
-            interval_ms = 3600 * 1000 # default 1h
-            if interval == "15m": interval_ms = 15 * 60 * 1000
-            elif interval == "4h": interval_ms = 4 * 3600 * 1000
+            interval_ms = INTERVAL_MS.get(interval, INTERVAL_MS["1h"])
             
             start_time = end_time - (limit * interval_ms)
             
@@ -71,15 +363,19 @@ class MarketDataService:
                 'v': 'volume'
             })
             
-            # Приводим типы данных из строк/чисел в floaf
+            # Приводим типы данных из строк/чисел в float32:
+            # точности float32 для теханализа достаточно, а памяти вдвое меньше
             numeric_cols = ['open', 'high', 'low', 'close', 'volume']
-            df[numeric_cols] = df[numeric_cols].apply(pd.to_numeric)
+            df[numeric_cols] = df[numeric_cols].astype('float32')
             
             # Добавляем читаемую дату
             df['datetime'] = pd.to_datetime(df['timestamp'], unit='ms')
             
-            # Сортируем по времени (на всякий случай) и берем последние limit
-            df = df.sort_values('timestamp').iloc[-limit:]
+            # API отдает свечи по возрастанию времени — сортируем только если это не так
+            if not df['timestamp'].is_monotonic_increasing:
+                df = df.sort_values('timestamp', kind='stable')
+            # Берем последние limit
+            df = df.iloc[-limit:]
             
             return df.reset_index(drop=True)
 
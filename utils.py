@@ -1,17 +1,23 @@
 
 import math
 
+# Точность для типовых шагов 1, 0.1, ..., 1e-8 — без вычисления логарифма
+_PRECISION = {10.0 ** -k: k for k in range(9)}
+
 def round_step_size(quantity: float, step_size: float) -> float:
     """
     Округляет число до ближайшего шага (step size).
     Нужно для корректной отправки объемов на биржу.
     """
-    if step_size < 0:
+    if step_size <= 0:
         return quantity
-    return float(int(quantity / step_size) * step_size)
+    return float(math.floor(quantity / step_size) * step_size)
 
 def get_precision(step_size: float) -> int:
     """Определяет количество знаков после запятой по шагу цены."""
-    if step_size == 0:
+    precision = _PRECISION.get(step_size)
+    if precision is not None:
+        return precision
+    if step_size <= 0:
         return 0
-    return int(round(-math.log(step_size, 10), 0))
+    return max(0, -math.floor(math.log10(step_size)))